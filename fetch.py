@@ -3,13 +3,17 @@
 import json
 import os
 from argparse import ArgumentParser, Namespace
-from time import time
-from typing import Any, Union
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from hashlib import blake2b
+from time import sleep, time
+from typing import Any, Optional
 
-from github import Github
-from github.Clones import Clones
-from github.Repository import Repository
-from github.View import View
+import orjson
+from requests import Session
+from requests.adapters import HTTPAdapter
+
+api_url = 'https://api.github.com'
 
 
 def parse_args() -> Namespace:
@@ -23,109 +27,249 @@ def parse_args() -> Namespace:
     return args.parse_args()
 
 
-def day_to_json(obj: Union[Clones, View]) -> dict[str, Any]:
-    """Dump one day of a timeseries to JSON.
+def make_session(token: str, pool_size: int = 16) -> Session:
+    """Create a keep-alive HTTP session for talking to the Github API.
 
     Args:
-        obj (Clones | View): The clones or views statistics for one day.
+        token (str): Github personal access token.
+        pool_size (int): Max number of pooled connections.
 
     Returns:
-        dict[str, Any]: JSON dict of the same info.
+        Session: The session.
     """
-    s = str(obj.timestamp)
-    date = s[:s.index(' ')]
-    return {
-        'date': date,
-        'count': obj.count,
-        'uniques': obj.uniques,
-    }
+    session = Session()
+    session.headers.update({
+        'Accept': 'application/vnd.github+json',
+        'Authorization': f'token {token}',
+    })
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    return session
 
 
-def traffic_to_json(obj: dict[str, Any], key: str) -> dict[str, Any]:
-    """Dump clones or views timeseries data to JSON.
+def wait_for_rate_limit(headers: dict[str, str],
+                        min_remaining: int = 10) -> None:
+    """Sleep until the rate limit resets if we are about to run out of quota.
 
     Args:
-        obj (dict[str, Any]): The raw clones or views dict.
-        key (str): Whether clones or views.
+        headers (dict[str, str]): Response headers.
+        min_remaining (int): Back off when fewer requests than this remain.
+    """
+    remaining = headers.get('X-RateLimit-Remaining')
+    reset = headers.get('X-RateLimit-Reset')
+    if remaining is None or reset is None:
+        return
+
+    if int(remaining) < min_remaining:
+        sleep(max(int(reset) - time(), 0) + 1)
+
+
+def get_json(session: Session, path: str,
+             cached: Optional[dict[str, Any]]) -> dict[str, Any]:
+    """Conditionally GET an API endpoint using the ETag of its last response.
+
+    Responses that are not modified (304) do not count against the rate limit,
+    and return the cached data as is. A 304 only means the response did not
+    change, not that its days were already recorded, so it is no reason on its
+    own to skip writing a line.
+
+    Args:
+        session (Session): HTTP session.
+        path (str): API path to get.
+        cached (Optional[dict[str, Any]]): ETag and data of the last response.
 
     Returns:
-        dict[str, Any]: JSON dict of the same info.
+        dict[str, Any]: ETag and data of the response.
     """
+    headers = {}
+    if cached:
+        headers['If-None-Match'] = cached['etag']
+
+    response = session.get(api_url + path, headers=headers)
+    wait_for_rate_limit(response.headers)
+    if response.status_code == 304:
+        return cached  # type: ignore
+
+    response.raise_for_status()
     return {
-        'count': obj['count'],
-        'uniques': obj['uniques'],
-        'daily': list(map(day_to_json, obj[key])),
+        'etag': response.headers.get('ETag'),
+        'data': response.json(),
     }
 
 
-def clones_traffic_to_json(repo: Repository) -> dict[str, Any]:
-    """Dump repo clones traffic to JSON.
+def get_repo_stats(session: Session, repo_names: list[str],
+                   batch_size: int = 100) -> list[dict[str, Any]]:
+    """Get the point stats of many repos using batched GraphQL queries.
 
     Args:
-        repo (Repository): The repo object.
+        session (Session): HTTP session.
+        repo_names (list[str]): Names of the repos.
+        batch_size (int): Max number of repos per query.
+
+    Returns:
+        list[dict[str, Any]]: JSON dict of stars, watchers, and forks per repo.
+    """
+    stats = []
+    for start in range(0, len(repo_names), batch_size):
+        batch = repo_names[start:start + batch_size]
+        params = []
+        fields = []
+        variables = {}
+        for i, repo_name in enumerate(batch):
+            params.append(f'$owner{i}: String!, $name{i}: String!')
+            fields.append(f'repo{i}: repository(owner: $owner{i}, '
+                          f'name: $name{i}) {{ ...stats }}')
+            variables[f'owner{i}'], variables[f'name{i}'] = \
+                repo_name.split('/')
+
+        query = f'query({", ".join(params)}) {{ {" ".join(fields)} }} ' + \
+            'fragment stats on Repository { nameWithOwner stargazerCount ' \
+            'forkCount watchers { totalCount } }'
+        response = session.post(api_url + '/graphql',
+                                json={'query': query, 'variables': variables})
+        wait_for_rate_limit(response.headers)
+        response.raise_for_status()
+        obj = response.json()
+        if obj.get('errors'):
+            raise ValueError(f'GraphQL query failed: {obj["errors"]}.')
+
+        for i in range(len(batch)):
+            repo = obj['data'][f'repo{i}']
+            stats.append({
+                'repo': repo['nameWithOwner'],
+                'stars': repo['stargazerCount'],
+                'watchers': repo['watchers']['totalCount'],
+                'forks': repo['forkCount'],
+            })
+    return stats
+
+
+def day_to_json(obj: dict[str, Any]) -> dict[str, Any]:
+    """Dump one day of a timeseries to JSON.
+
+    Args:
+        obj (dict[str, Any]): The clones or views statistics for one day.
 
     Returns:
         dict[str, Any]: JSON dict of the same info.
     """
-    obj = repo.get_clones_traffic()
-    return traffic_to_json(obj, 'clones')
+    s = obj['timestamp']
+    date = s[:s.index('T')]
+    return {
+        'date': date,
+        'count': obj['count'],
+        'uniques': obj['uniques'],
+    }
 
 
-def views_traffic_to_json(repo: Repository) -> dict[str, Any]:
-    """Dump repo views traffic to JSON.
+def traffic_to_json(obj: dict[str, Any], key: str) -> dict[str, Any]:
+    """Dump clones or views timeseries data to JSON.
 
     Args:
-        repo (Repository): The repo object.
+        obj (dict[str, Any]): The raw clones or views dict.
+        key (str): Whether clones or views.
 
     Returns:
         dict[str, Any]: JSON dict of the same info.
     """
-    obj = repo.get_views_traffic()
-    return traffic_to_json(obj, 'views')
+    return {
+        'count': obj['count'],
+        'uniques': obj['uniques'],
+        'daily': list(map(day_to_json, obj[key])),
+    }
 
 
-def repo_to_json(repo: Repository) -> dict[str, Any]:
+def repo_to_json(session: Session, repo_name: str, stats: dict[str, Any],
+                 last: dict[str, Any]) -> \
+        tuple[Optional[dict[str, Any]], dict[str, Any]]:
     """Dump repo traffic to JSON.
 
     Args:
-        repo (Repository): The repo object.
+        session (Session): HTTP session.
+        repo_name (str): Name of the repo.
+        stats (dict[str, Any]): Point stats of the repo.
+        last (dict[str, Any]): Payload hash and cached traffic responses of
+            the last fetch of this repo, if any.
 
     Returns:
-        dict[str, Any]: JSON dict of the fields we want.
+        tuple[Optional[dict[str, Any]], dict[str, Any]]: JSON dict of the
+            fields we want, or None if nothing changed since an earlier fetch
+            the same day, and the payload hash and traffic responses to cache
+            for the next fetch.
     """
-    clones = clones_traffic_to_json(repo)
-    views = views_traffic_to_json(repo)
-    return {
+    path = f'/repos/{repo_name}/traffic'
+    clones = get_json(session, f'{path}/clones', last.get('clones'))
+    views = get_json(session, f'{path}/views', last.get('views'))
+    obj = {
         'time': time(),
-        'repo': repo.full_name,
-        'stars': repo.stargazers_count,
-        'watchers': repo.subscribers_count,
-        'forks': repo.forks_count,
+        **stats,
+        'clones': traffic_to_json(clones['data'], 'clones'),
+        'views': traffic_to_json(views['data'], 'views'),
+    }
+
+    # Processing only trusts each crawl for the days well before it was made,
+    # so an unchanged payload still needs a line per day to cover new days.
+    payload = {key: value for key, value in obj.items() if key != 'time'}
+    payload['date'] = date.fromtimestamp(obj['time']).isoformat()
+    payload = orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)
+    digest = blake2b(payload, digest_size=16).hexdigest()
+    entry = {
+        'hash': digest,
         'clones': clones,
         'views': views,
     }
+    if digest == last.get('hash'):
+        return None, entry
+
+    return obj, entry
 
 
-def fetch_repos(github: Github, repo_names: list[str], filename: str) -> None:
+def fetch_repos(session: Session, repo_names: list[str], filename: str,
+                cache_file: str, num_workers: int = 8) -> None:
     """Fetch traffic data for the given repos, saving to file.
 
-    The data is stored as JSON per line. There is one linle per repo per fetch.
+    The data is stored as JSON per line. There is one line per repo per fetch,
+    except for repos whose data has not changed since an earlier fetch the
+    same day. What each repo looked like as of its last fetch is kept in the
+    cache file, which is replaced atomically after the new lines are written.
 
     Args:
-        github (Github): Github API instance.
+        session (Session): HTTP session.
         repo_names (str): Names of the repos to fetch traffic for.
         filename (str): Where to save crawled data.
+        cache_file (str): Where to persist payload hashes, ETags, and data
+            between fetches.
+        num_workers (int): Number of repos to fetch concurrently.
     """
     dirname = os.path.dirname(filename)
     if not os.path.exists(dirname):
         os.makedirs(dirname)
 
-    with open(filename, 'a') as out:
-        for repo_name in repo_names:
-            repo = github.get_repo(repo_name)
-            obj = repo_to_json(repo)
-            line = json.dumps(obj, sort_keys=True) + '\n'
-            out.write(line)
+    if os.path.exists(cache_file):
+        last_cache = json.load(open(cache_file))
+    else:
+        last_cache = {}
+    cache = {}
+
+    def fetch_one(repo_name: str, stats: dict[str, Any]) -> Optional[bytes]:
+        last = last_cache.get(repo_name, {})
+        obj, cache[repo_name] = repo_to_json(session, repo_name, stats, last)
+        if obj is None:
+            return None
+        option = orjson.OPT_SORT_KEYS | orjson.OPT_APPEND_NEWLINE
+        return orjson.dumps(obj, option=option)
+
+    repo_stats = get_repo_stats(session, repo_names)
+    with ThreadPoolExecutor(num_workers) as executor:
+        lines = list(executor.map(fetch_one, repo_names, repo_stats))
+
+    with open(filename, 'ab') as out:
+        out.write(b''.join(filter(None, lines)))
+
+    tmp_file = cache_file + '.tmp'
+    with open(tmp_file, 'w') as out:
+        json.dump(cache, out)
+    os.replace(tmp_file, cache_file)
 
 
 def main(args: Namespace) -> None:
@@ -136,10 +280,12 @@ def main(args: Namespace) -> None:
     """
     config = json.load(open(args.config))
     token = config['token']
-    github = Github(token)
+    session = make_session(token)
     repo_names = config['repos']
     filename = config['raw']
-    fetch_repos(github, repo_names, filename)
+    default_cache_file = os.path.join(os.path.dirname(filename), 'cache.json')
+    cache_file = config.get('cache', default_cache_file)
+    fetch_repos(session, repo_names, filename, cache_file)
 
 
 if __name__ == '__main__':
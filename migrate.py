@@ -0,0 +1,113 @@
+"""Compacting raw repo traffic data from JSON lines into Parquet."""
+
+import json
+import os
+from argparse import ArgumentParser, Namespace
+from typing import Any, Iterator
+
+import orjson
+import pyarrow as pa
+from pyarrow import parquet as pq
+
+day_type = pa.struct([
+    ('date', pa.string()),
+    ('count', pa.int64()),
+    ('uniques', pa.int64()),
+])
+
+traffic_type = pa.struct([
+    ('count', pa.int64()),
+    ('uniques', pa.int64()),
+    ('daily', pa.list_(day_type)),
+])
+
+schema = pa.schema([
+    ('time', pa.float64()),
+    ('repo', pa.string()),
+    ('stars', pa.int64()),
+    ('watchers', pa.int64()),
+    ('forks', pa.int64()),
+    ('clones', traffic_type),
+    ('views', traffic_type),
+])
+
+
+def parse_args() -> Namespace:
+    """Parse command-line arguments.
+
+    Returns:
+        Namespace: Command-line arguments.
+    """
+    args = ArgumentParser()
+    args.add_argument('--config', type=str, default='data/config.json')
+    return args.parse_args()
+
+
+def each_batch(raw_file: str, batch_size: int) -> \
+        Iterator[list[dict[str, Any]]]:
+    """Iterate over the crawls of a raw file in batches.
+
+    Args:
+        raw_file (str): File containing raw crawl data in JSON.
+        batch_size (int): Max number of crawls per batch.
+
+    Returns:
+        Iterator[list[dict[str, Any]]]: Each batch of JSON dict per crawl.
+    """
+    objs = []
+    with open(raw_file, 'rb') as lines:
+        for line in lines:
+            objs.append(orjson.loads(line))
+            if len(objs) == batch_size:
+                yield objs
+                objs = []
+    if objs:
+        yield objs
+
+
+def compact(raw_file: str, compact_file: str,
+            batch_size: int = 10000) -> None:
+    """Move the crawls of a raw file to the end of a compacted Parquet file.
+
+    The Parquet file is rewritten with the new crawls appended, then the raw
+    file is truncated. Do not run this while a fetch is in progress.
+
+    Args:
+        raw_file (str): File containing raw crawl data in JSON.
+        compact_file (str): Parquet file containing compacted crawl data.
+        batch_size (int): Max number of crawls per row group written.
+    """
+    if not os.path.isfile(raw_file):
+        raise ValueError(f'Raw file is missing: {raw_file}.')
+
+    if not os.path.getsize(raw_file):
+        return
+
+    tmp_file = compact_file + '.tmp'
+    with pq.ParquetWriter(tmp_file, schema, compression='zstd') as writer:
+        if os.path.exists(compact_file):
+            for batch in pq.ParquetFile(compact_file).iter_batches():
+                writer.write_batch(batch)
+        for objs in each_batch(raw_file, batch_size):
+            table = pa.Table.from_pylist(objs, schema)
+            writer.write_table(table)
+
+    os.replace(tmp_file, compact_file)
+    open(raw_file, 'wb').close()
+
+
+def main(args: Namespace) -> None:
+    """Main method.
+
+    Args:
+        args (Namespace): Command-line arguments.
+    """
+    config = json.load(open(args.config))
+    raw_file = config['raw']
+    default_compact_file = os.path.splitext(raw_file)[0] + '.parquet'
+    compact_file = config.get('compact', default_compact_file)
+    compact(raw_file, compact_file)
+
+
+if __name__ == '__main__':
+    main(parse_args())
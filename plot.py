@@ -4,9 +4,17 @@ import json
 import os
 from argparse import ArgumentParser, Namespace
 from datetime import date
-from shutil import rmtree
+from functools import lru_cache
+from multiprocessing import Pool
+from typing import Any
 
-from matplotlib import pyplot as plt
+import matplotlib
+import numpy as np
+from matplotlib.axes import Axes
+from matplotlib.figure import Figure
+
+matplotlib.use('Agg')
+matplotlib.rcParams.update({'font.size': 6})
 
 
 def parse_args() -> Namespace:
@@ -20,6 +28,47 @@ def parse_args() -> Namespace:
     return args.parse_args()
 
 
+def downsample(xs: list[Any], ys: list[int], max_points: int = 2000) -> \
+        tuple[list[Any], list[int]]:
+    """Downsample a long trace for plotting, preserving its visual envelope.
+
+    The trace is split into buckets, keeping the min and max point of each.
+
+    Args:
+        xs (list[Any]): X values.
+        ys (list[int]): Y values.
+        max_points (int): Max number of points to keep.
+
+    Returns:
+        tuple[list[Any], list[int]]: Downsampled X and Y values.
+    """
+    if len(ys) <= max_points:
+        return xs, ys
+
+    values = np.asarray(ys)
+    bounds = np.linspace(0, len(ys), max_points // 2 + 1).astype(np.int64)
+    idxs = []
+    for start, stop in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        bucket = values[start:stop]
+        min_idx = start + int(bucket.argmin())
+        max_idx = start + int(bucket.argmax())
+        idxs += sorted({min_idx, max_idx})
+
+    return [xs[i] for i in idxs], [ys[i] for i in idxs]
+
+
+@lru_cache(maxsize=None)
+def get_figure() -> tuple[Figure, Axes]:
+    """Get this process's figure, which is created once and reused per plot.
+
+    Returns:
+        tuple[Figure, Axes]: The figure and its axes.
+    """
+    fig = Figure()
+    ax = fig.add_subplot()
+    return fig, ax
+
+
 def plot_repo(proc_file: str, plot_file: str) -> None:
     """Plot one repo.
 
@@ -42,9 +91,10 @@ def plot_repo(proc_file: str, plot_file: str) -> None:
     obj = json.load(open(proc_file))
     repo = obj['repo']
 
-    plt.rcParams.update({'font.size': 6})
-    plt.yscale('log')
-    plt.title(f'{repo} traffic')
+    fig, ax = get_figure()
+    ax.clear()
+    ax.set_yscale('log')
+    ax.set_title(f'{repo} traffic')
 
     which2dates = {}
     for which in ['daily', 'point']:
@@ -53,32 +103,50 @@ def plot_repo(proc_file: str, plot_file: str) -> None:
     for key, which, color, line_style in fields:
         dates = which2dates[which]
         values = obj[which][key]
-        plt.plot(dates, values, label=key, color=color, lw=line_width, ls=line_style)
+        if which == 'point':
+            dates, values = downsample(dates, values)
+        ax.plot(dates, values, label=key, color=color, lw=line_width,
+                ls=line_style)
 
-    plt.grid(color='#ccc', ls=':', lw=0.5)
-    plt.legend()
-    plt.savefig(plot_file, dpi=400)
-    plt.clf()
+    ax.grid(color='#ccc', ls=':', lw=0.5)
+    ax.legend()
+    fig.savefig(plot_file, dpi=400)
 
 
 def plot_repos(proc_dir: str, plot_dir: str) -> None:
     """Plot all repos.
 
+    Repos whose plot is already newer than their processed data are skipped,
+    and plots of repos that are no longer processed are removed. The rest are
+    rendered in parallel, one process per core.
+
     Args:
         proc_dir (str): Directory containing one processed JSON file per repo.
         plot_dir (str): Directory to contain one plot per repo.
     """
-    if os.path.exists(plot_dir):
-        rmtree(plot_dir)
-    os.makedirs(plot_dir)
+    os.makedirs(plot_dir, exist_ok=True)
 
     proc_basenames = sorted(os.listdir(proc_dir))
+    plot_basenames = set()
+    jobs = []
     for proc_basename in proc_basenames:
         assert proc_basename.endswith('.json')
         plot_basename = proc_basename[:-5] + '.png'
+        plot_basenames.add(plot_basename)
         proc_file = os.path.join(proc_dir, proc_basename)
         plot_file = os.path.join(plot_dir, plot_basename)
-        plot_repo(proc_file, plot_file)
+        if os.path.exists(plot_file) and \
+                os.path.getmtime(proc_file) <= os.path.getmtime(plot_file):
+            continue
+        jobs.append((proc_file, plot_file))
+
+    if jobs:
+        with Pool() as pool:
+            pool.starmap(plot_repo, jobs)
+
+    for plot_basename in os.listdir(plot_dir):
+        if plot_basename not in plot_basenames:
+            os.remove(os.path.join(plot_dir, plot_basename))
 
 
 def main(args: Namespace) -> None:
@@ -4,10 +4,15 @@ import json
 import os
 from argparse import ArgumentParser, Namespace
 from collections import defaultdict
-from datetime import date, datetime, timedelta
+from datetime import date
+from functools import lru_cache
 from shutil import rmtree
 from time import mktime
-from typing import Any, Iterator
+from typing import Any, Iterator, Optional
+
+import numpy as np
+import orjson
+from pyarrow import parquet as pq
 
 
 def parse_args() -> Namespace:
@@ -21,49 +26,45 @@ def parse_args() -> Namespace:
     return args.parse_args()
 
 
-def date_range(start: date, stop: date) -> Iterator[date]:
-    """Iterate over a date range.
+@lru_cache(maxsize=None)
+def ordinal_from_date(ymd: str) -> int:
+    """Get the proleptic Gregorian ordinal of the given day.
 
     Args:
-        start (date): Start date.
-        stop (date): Stop date.
+        ymd (str): Year-month-day.
 
     Returns:
-        Iterator[date]: Each date, from start date to stop date.
+        int: Ordinal of that day.
     """
-    count = (stop - start).days
-    for i in range(count):
-        yield start + timedelta(i)
+    return date.fromisoformat(ymd).toordinal()
 
 
-def each_day(days: list[dict[str, Any]], fetch_time: float,
-             window_days: int) -> Iterator[tuple[str, int, int]]:
+def each_day(days: list[dict[str, Any]], fetch_ord: int,
+             window_days: int) -> Iterator[tuple[int, int, int]]:
     """Get each day of a timeseries.
 
     This is complicated by the fact that days with zero traffic are dropped.
 
     Args:
         days (list[dict[str, Any]]): The timeseries.
-        fetch_time (float): Timestamp of when the data was pulled, also the end
+        fetch_ord (int): Ordinal of the day the data was pulled, also the end
             of the timeseries window.
         window_days (int): How many days the timeseries window extends at most.
 
     Returns:
-        Iterator[tuple[str, int, int]]: Each day, including zero days.
+        Iterator[tuple[int, int, int]]: Each day as a proleptic Gregorian
+            ordinal, including zero days.
     """
     zero_pair = 0, 0
-    ymd2pair = defaultdict(lambda: zero_pair)
+    ord2pair = {}
     for day in days:
-        ymd = day['date']
-        assert ymd not in ymd2pair
-        ymd2pair[ymd] = day['count'], day['uniques']
+        day_ord = ordinal_from_date(day['date'])
+        assert day_ord not in ord2pair
+        ord2pair[day_ord] = day['count'], day['uniques']
 
-    fetch_date = date.fromtimestamp(fetch_time)
-    for ymd in date_range(fetch_date - timedelta(window_days - 2),
-                          fetch_date - timedelta(1)):
-        ymd = ymd.strftime('%Y-%m-%d')
-        count, unique = ymd2pair[ymd]
-        yield ymd, count, unique
+    for day_ord in range(fetch_ord - (window_days - 2), fetch_ord - 1):
+        count, unique = ord2pair.get(day_ord, zero_pair)
+        yield day_ord, count, unique
 
 
 def get_daily_stats(objs: list[dict[str, Any]], key: str, window_days: int) \
@@ -78,24 +79,29 @@ def get_daily_stats(objs: list[dict[str, Any]], key: str, window_days: int) \
     Returns:
         tuple[list[str], list[int], list[int]]: Timestamps, counts, uniques.
     """
-    date2pair = {}
-    for obj in objs:
+    fetch_ords = [date.fromtimestamp(obj['time']).toordinal() for obj in objs]
+    first_ord = min(fetch_ords) - (window_days - 2)
+    stop_ord = max(fetch_ords) - 1
+    num_days = stop_ord - first_ord
+
+    counts = np.zeros(num_days, np.int64)
+    uniques = np.zeros(num_days, np.int64)
+    is_set = np.zeros(num_days, np.bool_)
+    for obj, fetch_ord in zip(objs, fetch_ords):
         days = obj[key]['daily']
-        fetch_time = obj['time']
-        for date, count, unique in each_day(days, fetch_time, window_days):
-            if date not in date2pair:
-                date2pair[date] = count, unique
+        for day_ord, count, unique in each_day(days, fetch_ord, window_days):
+            idx = day_ord - first_ord
+            if not is_set[idx]:
+                counts[idx] = count
+                uniques[idx] = unique
+                is_set[idx] = True
             else:
-                assert date2pair[date] == (count, unique)
-
-    dates = sorted(date2pair)
-    pairs = []
-    for date in dates:
-        pair = date2pair[date]
-        pairs.append(pair)
+                assert counts[idx] == count and uniques[idx] == unique
 
-    counts, uniques = zip(*pairs)
-    return dates, counts, uniques  # type: ignore
+    idxs = np.flatnonzero(is_set)
+    dates = [date.fromordinal(first_ord + idx).isoformat()
+             for idx in idxs.tolist()]
+    return dates, counts[idxs].tolist(), uniques[idxs].tolist()
 
 
 def get_point_stats(objs: list[dict[str, Any]], key: str) -> \
@@ -117,6 +123,7 @@ def get_point_stats(objs: list[dict[str, Any]], key: str) -> \
     return times, values
 
 
+@lru_cache(maxsize=None)
 def noon_time_from_date(date: str) -> float:
     """Get the timestamp for the exact middle of the given day.
 
@@ -126,19 +133,65 @@ def noon_time_from_date(date: str) -> float:
     Returns:
         float: Timestamp of noon that day.
     """
-    noon_secs = 12 * 60 * 60
-    return mktime(datetime.strptime(date, '%Y-%m-%d').timetuple()) + noon_secs
+    year = int(date[:4])
+    month = int(date[5:7])
+    day = int(date[8:10])
+    return mktime((year, month, day, 12, 0, 0, 0, 0, -1))
 
 
-def process_repo(repo: str, objs: list[dict[str, Any]],
-                 proc_file: str) -> None:
+def merge_daily(old: dict[str, list[Any]],
+                new: dict[str, list[Any]]) -> dict[str, list[Any]]:
+    """Merge the processed daily stats of newer crawls into older ones.
+
+    Args:
+        old (dict[str, list[Any]]): Processed daily stats of older crawls.
+        new (dict[str, list[Any]]): Processed daily stats of newer crawls.
+
+    Returns:
+        dict[str, list[Any]]: Processed daily stats of all those crawls.
+    """
+    keys = 'clones', 'cloners', 'views', 'viewers'
+    key2date2value = {key: {} for key in keys}
+    for daily in [old, new]:
+        for key in keys:
+            date2value = key2date2value[key]
+            for ymd, value in zip(daily['dates'], daily[key]):
+                if ymd not in date2value:
+                    date2value[ymd] = value
+                else:
+                    assert date2value[ymd] == value
+
+    dates = sorted(key2date2value[keys[0]])
+    merged = {
+        'dates': dates,
+        'times': list(map(noon_time_from_date, dates)),
+    }
+    for key in keys:
+        date2value = key2date2value[key]
+        merged[key] = [date2value[ymd] for ymd in dates]
+    return merged
+
+
+def process_repo(repo: str, objs: list[dict[str, Any]], proc_file: str,
+                 merge: bool = False) -> None:
     """Process one repo given the crawls of that repo.
 
     Args:
         repo (str): Repo name.
         objs (list[dict[str, Any]]): List of JSON dict per crawl.
         proc_file (str): File to save processed run info to as JSON.
+        merge (bool): Whether to merge the crawls into the existing processed
+            file, if any, instead of replacing it. Crawls that are not newer
+            than the last one it contains are skipped.
     """
+    last = None
+    if merge and os.path.exists(proc_file):
+        last = orjson.loads(open(proc_file, 'rb').read())
+        last_time = last['point']['times'][-1]
+        objs = [obj for obj in objs if last_time < obj['time']]
+        if not objs:
+            return
+
     window_days = 14
     dates, clones, cloners = get_daily_stats(objs, 'clones', window_days)
     dates2, views, viewers = get_daily_stats(objs, 'views', window_days)
@@ -168,41 +221,122 @@ def process_repo(repo: str, objs: list[dict[str, Any]],
         },
     }
 
-    with open(proc_file, 'w') as out:
-        json.dump(obj, out)
+    if last:
+        obj['daily'] = merge_daily(last['daily'], obj['daily'])
+        for key, values in obj['point'].items():
+            obj['point'][key] = last['point'][key] + values
+
+    with open(proc_file, 'wb') as out:
+        out.write(orjson.dumps(obj))
 
 
-def process_repos(raw_file: str, proc_dir: str) -> None:
+def each_compacted_crawl(compact_file: Optional[str]) -> \
+        Iterator[dict[str, Any]]:
+    """Iterate over the crawls that were compacted out of the raw file.
+
+    Args:
+        compact_file (Optional[str]): Parquet file containing compacted crawls,
+            if any.
+
+    Returns:
+        Iterator[dict[str, Any]]: JSON dict per crawl.
+    """
+    if compact_file and os.path.isfile(compact_file):
+        for batch in pq.ParquetFile(compact_file).iter_batches():
+            yield from batch.to_pylist()
+
+
+def get_file_version(filename: Optional[str]) -> Optional[list[int]]:
+    """Get the modification time and size of a file, to tell if it changed.
+
+    Args:
+        filename (Optional[str]): Path to the file, if any.
+
+    Returns:
+        Optional[list[int]]: Modification time in nanoseconds and size, or None
+            if there is no such file.
+    """
+    if not filename or not os.path.isfile(filename):
+        return None
+
+    stat = os.stat(filename)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def process_repos(raw_file: str, proc_dir: str,
+                  compact_file: Optional[str] = None,
+                  state_file: Optional[str] = None) -> None:
     """Process all the repos that we have crawled.
 
+    If there is state left by the previous run, only the raw crawls appended
+    since then are read, and only the repos they touch are reprocessed, by
+    merging them into their existing processed files. Everything is processed
+    from scratch if there is no readable state or the compacted crawls changed.
+
     Args:
         raw_file (str): File containing raw crawl data in JSON.
         proc_dir (str): Directory to contain a processed JSON file per repo.
+        compact_file (Optional[str]): Parquet file containing older crawls that
+            were compacted out of the raw file, if any.
+        state_file (Optional[str]): File to track how far into the raw file we
+            have processed, if any.
     """
     if not os.path.isfile(raw_file):
         raise ValueError(f'Raw file is missing: {raw_file}.')
 
-    objs = open(raw_file)
-    objs = map(json.loads, objs)
-    objs = list(objs)
-
-    if not objs:
-        raise ValueError(f'Raw file contains no crawl data: {raw_file}.')
+    compact_version = get_file_version(compact_file)
+    state = None
+    if state_file and os.path.isfile(state_file):
+        try:
+            state = json.load(open(state_file))
+        except ValueError:
+            state = None
+    merge = bool(state) and os.path.isdir(proc_dir) and \
+        state['compact'] == compact_version and \
+        state['offset'] <= os.path.getsize(raw_file)
 
     repo2objs = defaultdict(list)
-    for obj in objs:
-        repo = obj['repo']
-        repo2objs[repo].append(obj)
-
-    if os.path.exists(proc_dir):
-        rmtree(proc_dir)
-    os.makedirs(proc_dir)
+    if merge:
+        offset = state['offset']  # type: ignore
+    else:
+        offset = 0
+        for obj in each_compacted_crawl(compact_file):
+            repo = obj['repo']
+            repo2objs[repo].append(obj)
+
+    with open(raw_file, 'rb') as lines:
+        lines.seek(offset)
+        for line in lines:
+            if not line.endswith(b'\n'):
+                break
+            offset += len(line)
+            obj = orjson.loads(line)
+            repo = obj['repo']
+            repo2objs[repo].append(obj)
+
+    if not merge:
+        if not repo2objs:
+            raise ValueError(f'Raw file contains no crawl data: {raw_file}.')
+
+        if os.path.exists(proc_dir):
+            rmtree(proc_dir)
+        os.makedirs(proc_dir)
 
     for repo in sorted(repo2objs):
         objs = repo2objs[repo]
         repo_basename = repo.replace('/', '.') + '.json'
         proc_file = os.path.join(proc_dir, repo_basename)
-        process_repo(repo, objs, proc_file)
+        process_repo(repo, objs, proc_file, merge)
+
+    if state_file:
+        state = {
+            'offset': offset,
+            'compact': compact_version,
+        }
+        tmp_file = state_file + '.tmp'
+        with open(tmp_file, 'w') as out:
+            json.dump(state, out)
+        os.replace(tmp_file, state_file)
 
 
 def main(args: Namespace) -> None:
@@ -213,8 +347,13 @@ def main(args: Namespace) -> None:
     """
     config = json.load(open(args.config))
     raw_file = config['raw']
+    default_compact_file = os.path.splitext(raw_file)[0] + '.parquet'
+    compact_file = config.get('compact', default_compact_file)
     proc_dir = config['proc']
-    process_repos(raw_file, proc_dir)
+    default_state_file = os.path.join(os.path.dirname(raw_file),
+                                      'proc_state.json')
+    state_file = config.get('proc_state', default_state_file)
+    process_repos(raw_file, proc_dir, compact_file, state_file)
 
 
 if __name__ == '__main__':
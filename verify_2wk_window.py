@@ -1,10 +1,13 @@
 """Verify the clones/views timeseries data must be within a two-week window."""
 
-import json
 from argparse import ArgumentParser, Namespace
-from datetime import datetime
+from array import array
+from functools import lru_cache
 from time import mktime
 
+import numpy as np
+import orjson
+
 
 def parse_args() -> Namespace:
     """Parse command-line arguments.
@@ -17,22 +20,38 @@ def parse_args() -> Namespace:
     return args.parse_args()
 
 
+@lru_cache(maxsize=None)
+def ymd_to_epoch(date: str) -> float:
+    """Get the timestamp for the start of the given day.
+
+    Args:
+        date (str): Year-month-day.
+
+    Returns:
+        float: Timestamp of midnight that day.
+    """
+    year = int(date[:4])
+    month = int(date[5:7])
+    day = int(date[8:10])
+    return mktime((year, month, day, 0, 0, 0, 0, 0, -1))
+
+
 def main(args: Namespace) -> None:
     """Main method.
 
     Args:
         args (Namespace): Command-line arguments.
     """
-    lines = open(args.data)
-    objs = map(json.loads, lines)
-    gaps = []
+    lines = open(args.data, 'rb')
+    objs = map(orjson.loads, lines)
+    gaps = array('d')
     for obj in objs:
         now = obj['time']
         thens = []
         for key in ['clones', 'views']:
             days = obj[key]['daily']
             date = days[0]['date']
-            then = mktime(datetime.strptime(date, '%Y-%m-%d').timetuple())
+            then = ymd_to_epoch(date)
             thens.append(then)
         then = min(thens)
         gap = now - then
@@ -45,8 +64,7 @@ def main(args: Namespace) -> None:
 
     sec_per_day = 24 * 60 * 60
     two_weeks = 14
-    gaps = list(map(lambda gap: gap / sec_per_day, gaps))
-    gaps.sort()
+    gaps = np.sort(np.frombuffer(gaps) / sec_per_day)
 
     print('Values:')
     for gap in gaps: